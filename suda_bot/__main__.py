@@ -1,19 +1,53 @@
+import logging
+
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from suda_bot.database import engine, async_session
-from suda_bot.middleware import DatabaseSessionMiddleware
+from suda_bot.database import engine, replica_engine, async_session, replica_session
+from suda_bot.middleware import DatabaseSessionMiddleware, AdmissionControlMiddleware
 from suda_bot.handlers import user_router, barista_router
 from suda_bot.database import init_db
-from suda_bot.config import TELEGRAM_BOT_TOKEN
+from suda_bot.config import (
+    TELEGRAM_BOT_TOKEN,
+    READ_YOUR_WRITES_SECONDS,
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_QUEUE_STAFF,
+    ADMISSION_QUEUE_REDEEM,
+    ADMISSION_QUEUE_BROWSE,
+    SLOW_UPDATE_DEBUG,
+    SLOW_UPDATE_THRESHOLD_MS,
+    FSM_STATE_TTL,
+    FSM_MAX_ENTRIES,
+)
 from suda_bot.scheduler import setup_scheduler
+from suda_bot.outbox import start_outbox_worker
+from suda_bot.profiling import setup_slow_update_detector, setup_handler_timing
+from suda_bot.storage import BoundedMemoryStorage
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
+
     bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=BoundedMemoryStorage(ttl=FSM_STATE_TTL, max_entries=FSM_MAX_ENTRIES))
 
     # Регистрируем middleware
-    dp.message.middleware(DatabaseSessionMiddleware(async_session))
-    dp.callback_query.middleware(DatabaseSessionMiddleware(async_session))
+    # Отладка медленных апдейтов — самая внешняя, чтобы учесть всё остальное
+    if SLOW_UPDATE_DEBUG:
+        setup_slow_update_detector(dp, bot, [engine, replica_engine], SLOW_UPDATE_THRESHOLD_MS)
+
+    # Контроль нагрузки: бариста обслуживаются первыми, лишние апдейты клиентов отбрасываются
+    admission = AdmissionControlMiddleware(
+        replica_session,
+        max_concurrency=ADMISSION_MAX_CONCURRENCY,
+        queue_sizes=(ADMISSION_QUEUE_STAFF, ADMISSION_QUEUE_REDEEM, ADMISSION_QUEUE_BROWSE)
+    )
+    dp.update.outer_middleware(admission)
+    dp["admission"] = admission
+
+    # Один экземпляр на оба типа апдейтов, чтобы учитывать недавние записи пользователя
+    db_middleware = DatabaseSessionMiddleware(async_session, replica_session, READ_YOUR_WRITES_SECONDS)
+    dp.message.middleware(db_middleware)
+    dp.callback_query.middleware(db_middleware)
+    if SLOW_UPDATE_DEBUG:
+        setup_handler_timing(dp)
 
     # Подключаем роутеры
     dp.include_router(user_router)
@@ -24,7 +58,13 @@ async def main():
     # Запускаем планировщик
     setup_scheduler(async_session)
 
-    await dp.start_polling(bot)
+    # Запускаем отправку уведомлений из outbox
+    outbox_worker = start_outbox_worker(bot, async_session)
+
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await outbox_worker.stop()
 
 if __name__ == '__main__':
     import asyncio
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from suda_bot.config import CUSTOMER_CACHE_SIZE, CUSTOMER_CACHE_TTL, STAFF_CACHE_TTL
+from suda_bot.models import Barista
+
+
+@dataclass
+class CachedCustomer:
+    """То, что обработчикам нужно знать о клиенте"""
+    id: int
+    telegram_id: int
+    first_name: str
+    phone_suffix: str
+    points: int
+
+    @classmethod
+    def from_user(cls, user) -> "CachedCustomer":
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            first_name=user.first_name,
+            phone_suffix=(user.phone or "")[-4:],
+            points=user.points or 0
+        )
+
+
+class CustomerCache:
+    """LRU-кэш клиентов по telegram_id с временем жизни записей.
+
+    Записи обновляются сквозной записью из регистрации и начисления/списания
+    баллов, TTL ограничивает расхождение с базой при нескольких процессах.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple[float, CachedCustomer]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int) -> Optional[CachedCustomer]:
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, customer = entry
+        if expires_at < time.monotonic():
+            del self._entries[telegram_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return customer
+
+    def put(self, customer: CachedCustomer) -> CachedCustomer:
+        self._entries[customer.telegram_id] = (time.monotonic() + self.ttl, customer)
+        self._entries.move_to_end(customer.telegram_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return customer
+
+    def set_points(self, telegram_id: int, points: int):
+        """Сквозная запись нового количества баллов (если клиент в кэше)"""
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            entry[1].points = points
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate
+        }
+
+
+customer_cache = CustomerCache(CUSTOMER_CACHE_SIZE, CUSTOMER_CACHE_TTL)
+
+
+class StaffCache:
+    """telegram_id всех бариста и администраторов.
+
+    Нужен, чтобы классифицировать апдейт без запроса к базе. Список
+    перечитывается раз в ``ttl`` секунд — так подхватываются бариста,
+    добавленные в других процессах.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._ids: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def __contains__(self, telegram_id: int) -> bool:
+        return telegram_id in self._ids
+
+    @property
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def refresh(self, session_pool: async_sessionmaker):
+        """Перечитывает список, если он устарел.
+
+        Параллельные вызовы ждут одну загрузку. Если загрузка упала, остаётся
+        прежний список, а следующий вызов попробует снова.
+        """
+        async with self._lock:
+            # Пока ждали блокировку, список мог обновить другой апдейт
+            if not self.is_stale:
+                return
+            async with session_pool() as session:
+                result = await session.execute(select(Barista.telegram_id))
+                self._ids = set(result.scalars().all())
+            self._loaded_at = time.monotonic()
+
+    def add(self, telegram_id: int):
+        self._ids.add(telegram_id)
+
+
+staff_cache = StaffCache(STAFF_CACHE_TTL)
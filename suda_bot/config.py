@@ -4,4 +4,34 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-DATABASE_URL = os.getenv("DATABASE_URL")
\ No newline at end of file
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Реплика только для чтения (необязательно)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Сколько секунд после своей записи пользователь читает из основной базы
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# Кэш клиентов в памяти процесса
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "10000"))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "60"))
+# Отправка уведомлений из outbox
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# Сколько соединений на чтение держать в режиме SQLite
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
+# Размер пачки удаления в задачах планировщика
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "1000"))
+# Как часто перечитывать список бариста для приоритизации апдейтов
+STAFF_CACHE_TTL = float(os.getenv("STAFF_CACHE_TTL", "60"))
+# Контроль нагрузки: одновременно обрабатываемые апдейты и размеры очередей по приоритетам
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "8"))
+ADMISSION_QUEUE_STAFF = int(os.getenv("ADMISSION_QUEUE_STAFF", "100"))
+ADMISSION_QUEUE_REDEEM = int(os.getenv("ADMISSION_QUEUE_REDEEM", "50"))
+ADMISSION_QUEUE_BROWSE = int(os.getenv("ADMISSION_QUEUE_BROWSE", "20"))
+# Отладка медленных апдейтов: JSON-лог апдейтов дольше порога с разбивкой по спанам
+SLOW_UPDATE_DEBUG = os.getenv("SLOW_UPDATE_DEBUG", "").lower() in ("1", "true", "yes")
+SLOW_UPDATE_THRESHOLD_MS = float(os.getenv("SLOW_UPDATE_THRESHOLD_MS", "500"))
+# Куда сохранять профили, снятые командой /profile
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Хранилище состояний FSM: время жизни записи (сек.) и максимальное число записей
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_MAX_ENTRIES = int(os.getenv("FSM_MAX_ENTRIES", "10000"))
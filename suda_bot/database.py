@@ -1,12 +1,112 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import zlib
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from suda_bot.config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from suda_bot.config import DATABASE_URL, DATABASE_REPLICA_URL, SQLITE_READ_POOL_SIZE
 
 Base = declarative_base()
 
-engine = create_async_engine(DATABASE_URL)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-8000")  # ~8 МБ на соединение
+    cursor.close()
+
+
+def _create_sqlite_engines(url):
+    """Встроенный режим без PostgreSQL.
+
+    Пишет ровно одно соединение (pool_size=1): остальные писатели ждут
+    его в очереди пула, поэтому SQLite не упирается в «database is locked».
+    Читатели в режиме WAL не мешают писателю и берут отдельный пул,
+    который middleware отдаёт обработчикам с флагом read_only.
+    """
+    if make_url(url).database in (None, "", ":memory:"):
+        # У каждого соединения своя база в памяти — писатель и читатели разошлись бы
+        raise ValueError("SQLite в памяти не поддерживается, укажите путь к файлу базы")
+
+    engine = create_async_engine(url, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0)
+    reader_engine = create_async_engine(
+        url, poolclass=AsyncAdaptedQueuePool, pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0
+    )
+    for sqlite_engine in (engine, reader_engine):
+        event.listen(sqlite_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine, reader_engine
+
+
+if make_url(DATABASE_URL).get_backend_name() == "sqlite":
+    engine, replica_engine = _create_sqlite_engines(DATABASE_URL)
+else:
+    engine = create_async_engine(DATABASE_URL)
+    # Реплика для обработчиков только на чтение. Без неё — та же основная база.
+    replica_engine = create_async_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
+
 async_session = async_sessionmaker(engine, expire_on_commit=False)
+if replica_engine is engine:
+    replica_session = async_session
+else:
+    replica_session = async_sessionmaker(replica_engine, expire_on_commit=False)
+
+async def _lock_migrations(conn: AsyncConnection):
+    """Advisory-блокировка до конца транзакции: схему меняет одна реплика, остальные ждут.
+
+    Повторный вызов в той же транзакции не блокирует.
+    """
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"),
+        {"key": zlib.crc32(b"suda_bot.migrate_db")}
+    )
+
+async def migrate_db(conn: AsyncConnection):
+    """Доводит существующую базу PostgreSQL до текущих моделей. Каждый шаг идемпотентен."""
+    await _lock_migrations(conn)
+
+    # telegram_id: VARCHAR -> BIGINT
+    for table in ("users", "baristas"):
+        data_type = await conn.scalar(
+            text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_schema = current_schema() "
+                "AND table_name = :table AND column_name = 'telegram_id'"
+            ),
+            {"table": table}
+        )
+        if data_type and data_type != "bigint":
+            await conn.execute(text(
+                f"ALTER TABLE {table} ALTER COLUMN telegram_id TYPE BIGINT USING telegram_id::bigint"
+            ))
+
+    # Внешний ключ daily_codes.user_id -> users.id (коды удалённых клиентов удаляем)
+    has_fk = await conn.scalar(text(
+        "SELECT 1 FROM pg_constraint "
+        "WHERE conname = 'daily_codes_user_id_fkey' AND conrelid = 'daily_codes'::regclass"
+    ))
+    if not has_fk:
+        await conn.execute(text(
+            "DELETE FROM daily_codes d WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = d.user_id)"
+        ))
+        await conn.execute(text(
+            "ALTER TABLE daily_codes ADD CONSTRAINT daily_codes_user_id_fkey "
+            "FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE"
+        ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_daily_codes_user_id ON daily_codes (user_id)"
+    ))
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        is_postgres = conn.dialect.name == "postgresql"
+        if is_postgres:
+            # Реплики стартуют одновременно — создание таблиц тоже под блокировкой
+            await _lock_migrations(conn)
+        await conn.run_sync(Base.metadata.create_all)
+        if is_postgres:
+            await migrate_db(conn)
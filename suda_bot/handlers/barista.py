@@ -1,15 +1,26 @@
-from aiogram import Router, F
-from aiogram.filters import Command
+import asyncio
+import re
+from collections import Counter, defaultdict
+from typing import Optional
+
+from aiogram import Router, F, flags, types
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-from sqlalchemy import select, update
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import and_, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from suda_bot.handlers.user import is_barista
-from suda_bot.models import User, Barista
-from suda_bot.config import TELEGRAM_BOT_TOKEN
-from aiogram import Bot
+from suda_bot.cache import customer_cache, staff_cache
+from suda_bot.config import PROFILE_DIR
+from suda_bot.handlers.user import is_barista, history_keyboard
+from suda_bot.middleware import AdmissionControlMiddleware
+from suda_bot.models import User, Barista, DailyCode, PointsHistory
+from suda_bot.outbox import enqueue_notification, wake_outbox
+from suda_bot.profiling import run_sampling_profile
+from suda_bot.storage import BoundedMemoryStorage
+from suda_bot.utils import get_customer, get_history_page, format_history, decode_history_cursor
 
 barista_router = Router()
 
@@ -46,7 +57,7 @@ def admin_menu_keyboard():
 
 
 # --- Вспомогательная функция для проверки администратора ---
-async def is_admin_barista(telegram_id: str, session: AsyncSession) -> bool:
+async def is_admin_barista(telegram_id: int, session: AsyncSession) -> bool:
     barista = await session.execute(
         select(Barista).where(Barista.telegram_id == telegram_id, Barista.is_admin == True)
     )
@@ -55,15 +66,16 @@ async def is_admin_barista(telegram_id: str, session: AsyncSession) -> bool:
 
 # --- Команды ---
 @barista_router.message(Command("start"))
+@flags.read_only
 async def cmd_start(message: Message, session: AsyncSession):
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if is_admin:
         await message.answer("Привет, администратор!", reply_markup=admin_menu_keyboard())
         return
 
     barista = await session.execute(
-        select(Barista).where(Barista.telegram_id == str(message.from_user.id))
+        select(Barista).where(Barista.telegram_id == message.from_user.id)
     )
     if barista := barista.scalar_one_or_none():
         await message.answer("Привет, бариста!", reply_markup=barista_menu_keyboard())
@@ -72,8 +84,9 @@ async def cmd_start(message: Message, session: AsyncSession):
 
 
 @barista_router.message(Command("new_barista"))
+@flags.read_only
 async def cmd_new_barista(message: Message, session: AsyncSession, state: FSMContext):
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if not is_admin:
         await message.answer("У вас нет прав для выполнения этой команды.")
@@ -83,8 +96,9 @@ async def cmd_new_barista(message: Message, session: AsyncSession, state: FSMCon
     await state.set_state(BaristaStates.waiting_for_new_barista_id)
 
 @barista_router.message(F.text == "Назначить бариста")
+@flags.read_only
 async def ask_new_barista(message: Message, session: AsyncSession, state: FSMContext):
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if not is_admin:
         await message.answer("У вас нет прав для выполнения этой команды.")
@@ -96,19 +110,23 @@ async def ask_new_barista(message: Message, session: AsyncSession, state: FSMCon
 
 @barista_router.message(BaristaStates.waiting_for_new_barista_id, F.text.isdigit())
 async def handle_new_barista_id(message: Message, session: AsyncSession, state: FSMContext):
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if not is_admin:
+        # Перед ответом без записи завершаем транзакцию, чтобы не держать
+        # соединение (в SQLite — единственное пишущее) во время запроса к Telegram
+        await session.rollback()
         await message.answer("У вас нет прав для выполнения этой команды.")
         await state.clear()
         return
 
-    new_barista_id = message.text.strip()
+    new_barista_id = int(message.text.strip())
 
     existing_barista = await session.execute(
         select(Barista).where(Barista.telegram_id == new_barista_id)
     )
     if existing_barista.scalar_one_or_none():
+        await session.rollback()
         await message.answer(f"Пользователь с ID {new_barista_id} уже является бариста.")
         await state.clear()
         return
@@ -116,6 +134,7 @@ async def handle_new_barista_id(message: Message, session: AsyncSession, state:
     new_barista = Barista(telegram_id=new_barista_id, is_admin=False)
     session.add(new_barista)
     await session.commit()
+    staff_cache.add(new_barista_id)
 
     await message.answer(f"Пользователь с ID {new_barista_id} добавлен как бариста.")
     await state.clear()
@@ -135,117 +154,162 @@ async def ask_for_check_discount(message: Message, state: FSMContext):
 
 # --- Ввести код клиенту ---
 @barista_router.message(F.text == "Ввести код клиенту")
+@flags.read_only
 async def ask_for_enter_code(message: Message, state: FSMContext, session: AsyncSession):
     # Проверяем, что пользователь — бариста или админ
-    is_barista_user = await is_barista(str(message.from_user.id), session)
+    is_barista_user = await is_barista(message.from_user.id, session)
     if not is_barista_user:
         await message.answer("У вас нет доступа к этой функции.")
         return
 
-    await message.answer("Введите имя, последние 4 цифры телефона и код (например: Иван 4721: 123456)")
+    await message.answer(
+        "Введите имя, последние 4 цифры телефона и код (например: Иван 4721: 123456).\n"
+        "Несколько кодов можно ввести одним сообщением — каждый с новой строки."
+    )
     await state.set_state(BaristaStates.waiting_for_enter_code)
 
 
-@barista_router.message(BaristaStates.waiting_for_enter_code, F.text.regexp(r"^[^:]+ \d{4}: \d{6}$"))
+# Строка ввода кода за клиента: "Иван 4721: 123456"
+CODE_LINE_RE = re.compile(r"^(?P<first_name>[^:]+) (?P<digits>\d{4}): (?P<code>\d{6})$")
+
+
+@barista_router.message(
+    BaristaStates.waiting_for_enter_code,
+    F.text.regexp(r"^[^:\n]+ \d{4}: \d{6}$", mode="search", flags=re.MULTILINE)
+)
 async def handle_code_from_barista(message: Message, session: AsyncSession, state: FSMContext):
     # Повторная проверка, что пользователь — бариста или админ
-    is_barista_user = await is_barista(str(message.from_user.id), session)
+    is_barista_user = await is_barista(message.from_user.id, session)
     if not is_barista_user:
+        # Перед ответом без записи завершаем транзакцию, чтобы не держать
+        # соединение (в SQLite — единственное пишущее) во время запроса к Telegram
+        await session.rollback()
         await message.answer("У вас нет доступа к этой функции.")
         await state.clear()
         return
 
-    text = message.text.strip()
-    # Разделяем на части: до ": " и после
-    parts = text.split(': ')
-    if len(parts) != 2:
-        await message.answer("Неверный формат. Введите: имя 4 цифры: код")
-        return
-
-    name_and_digits = parts[0].strip()
-    code = parts[1].strip()
-
-    # Разделяем имя и 4 цифры
-    name_parts = name_and_digits.rsplit(' ', 1)
-    if len(name_parts) != 2:
-        await message.answer("Неверный формат. Введите: имя 4 цифры: код")
-        return
-
-    first_name = name_parts[0].strip()
-    last_4_digits = name_parts[1].strip()
-
-    if not last_4_digits.isdigit() or len(last_4_digits) != 4:
-        await message.answer("Последние 4 цифры должны быть числом из 4 цифр.")
-        return
-
-    if not code.isdigit() or len(code) != 6:
-        await message.answer("Код должен быть числом из 6 цифр.")
-        return
-
-    # Находим пользователя по имени и 4 цифрам
-    user = await session.execute(
-        select(User).where(
-            User.first_name == first_name,
-            User.phone.like(f"%{last_4_digits}")
+    # Несколько кодов можно ввести одним сообщением, по одному на строку.
+    # results: (строка, сообщение об ошибке); None вместо ошибки — код принят
+    results = []
+    entries = []  # (индекс в results, имя, 4 цифры, код)
+    seen_codes = set()
+    for line in message.text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = CODE_LINE_RE.match(line)
+        if not match:
+            results.append([line, "Неверный формат. Введите: имя 4 цифры: код"])
+        elif match["code"] in seen_codes:
+            results.append([line, "Этот код уже есть в сообщении."])
+        else:
+            seen_codes.add(match["code"])
+            entries.append((len(results), match["first_name"].strip(), match["digits"], match["code"]))
+            results.append([line, None])
+
+    if entries:
+        # Один запрос на всех клиентов по имени и 4 цифрам телефона
+        users = await session.execute(
+            select(User).where(or_(*(
+                and_(User.first_name == first_name, User.phone.like(f"%{digits}"))
+                for first_name, digits in {(e[1], e[2]) for e in entries}
+            )))
         )
-    )
-    user = user.scalar_one_or_none()
-
-    if not user:
-        await message.answer("Пользователь не найден.")
-        await state.clear()
-        return
-
-    # Проверяем, существует ли такой код и не использован ли он
-    from suda_bot.models import DailyCode
-    db_code = await session.execute(
-        select(DailyCode).where(
-            DailyCode.code == code,
-            DailyCode.is_used == False
-        )
-    )
-    db_code = db_code.scalar_one_or_none()
-
-    if not db_code:
-        await message.answer("Неверный или уже использованный код.")
-        await state.clear()
-        return
-
-    # Проверяем, принадлежит ли код пользователю
-    if db_code.user_id != user.id:
-        await message.answer("Этот код не принадлежит указанному пользователю.")
-        await state.clear()
-        return
-
-    # Помечаем код как использованный
-    stmt = (
-        update(DailyCode)
-        .where(DailyCode.id == db_code.id)
-        .values(is_used=True)
-    )
-    await session.execute(stmt)
-
-    # Начисляем 1 балл пользователю
-    stmt_user = (
-        update(User)
-        .where(User.telegram_id == user.telegram_id)
-        .values(points=User.points + 1)
-    )
-    await session.execute(stmt_user)
-    await session.commit()
-
-    # Отправляем уведомление пользователю
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    try:
-        await bot.send_message(
-            chat_id=user.telegram_id,
-            text=f"Вы получили 1 балл! Теперь у вас {user.points} баллов."
+        users_by_key = defaultdict(list)
+        for user in users.scalars():
+            users_by_key[(user.first_name, user.phone[-4:])].append(user)
+
+        # Один запрос на все коды
+        codes = await session.execute(
+            select(DailyCode).where(
+                DailyCode.code.in_([e[3] for e in entries]),
+                DailyCode.is_used == False
+            )
         )
-    except Exception:
-        pass  # Не удалось отправить — не критично
-
-    # Отправляем уведомление баристе
-    await message.answer(f"Балл клиенту {user.first_name} {last_4_digits} начислен!")
+        codes_by_value = {c.code: c for c in codes.scalars()}
+
+        to_redeem = {}  # id кода -> (индекс в results, пользователь)
+        for index, first_name, digits, code in entries:
+            candidates = users_by_key.get((first_name, digits))
+            db_code = codes_by_value.get(code)
+            if not candidates:
+                results[index][1] = "Пользователь не найден."
+            elif not db_code:
+                results[index][1] = "Неверный или уже использованный код."
+            else:
+                owner = next((u for u in candidates if u.id == db_code.user_id), None)
+                if owner is None:
+                    results[index][1] = "Этот код не принадлежит указанному пользователю."
+                else:
+                    to_redeem[db_code.id] = (index, owner)
+
+        if to_redeem:
+            # Помечаем коды как использованные; RETURNING отсекает коды,
+            # которые успели использовать параллельно
+            redeemed_ids = await session.execute(
+                update(DailyCode)
+                .where(DailyCode.id.in_(to_redeem), DailyCode.is_used == False)
+                .values(is_used=True)
+                .returning(DailyCode.id)
+            )
+            redeemed_ids = set(redeemed_ids.scalars().all())
+
+            points_by_user = Counter()
+            users_by_id = {}
+            history = []
+            for code_id, (index, user) in to_redeem.items():
+                if code_id in redeemed_ids:
+                    points_by_user[user.id] += 1
+                    users_by_id[user.id] = user
+                    # Одна запись истории на каждый погашенный код
+                    history.append(PointsHistory(user_id=user.id, delta=1, reason="code"))
+                else:
+                    results[index][1] = "Неверный или уже использованный код."
+
+            # Начисляем баллы: один UPDATE на каждое различное число баллов (обычно один)
+            new_points = {}
+            user_ids_by_amount = defaultdict(list)
+            for user_id, amount in points_by_user.items():
+                user_ids_by_amount[amount].append(user_id)
+            for amount, user_ids in user_ids_by_amount.items():
+                updated = await session.execute(
+                    update(User)
+                    .where(User.id.in_(user_ids))
+                    .values(points=User.points + amount)
+                    .returning(User.id, User.points)
+                )
+                new_points.update(updated.tuples().all())
+
+            session.add_all(history)
+
+            # Уведомления клиентам уходят через outbox в той же транзакции
+            for user_id, points in new_points.items():
+                amount = points_by_user[user_id]
+                if amount == 1:
+                    text = f"Вы получили 1 балл! Теперь у вас {points} баллов."
+                else:
+                    # Несколько кодов одного клиента в одном сообщении
+                    text = f"Начислено баллов за коды: {amount}. Теперь у вас {points} баллов."
+                enqueue_notification(session, users_by_id[user_id].telegram_id, text)
+            await session.commit()
+            wake_outbox()
+
+            for user_id, points in new_points.items():
+                customer_cache.set_points(users_by_id[user_id].telegram_id, points)
+
+    # Отправляем итог баристе. Если ничего не начислено, транзакция только
+    # читала — завершаем её, чтобы не держать соединение во время ответа
+    await session.rollback()
+    if len(results) == 1:
+        line, error = results[0]
+        match = CODE_LINE_RE.match(line)
+        await message.answer(error or f"Балл клиенту {match['first_name'].strip()} {match['digits']} начислен!")
+    else:
+        accepted = sum(1 for _, error in results if error is None)
+        lines = [f"Начислено баллов: {accepted} из {len(results)}"]
+        for line, error in results:
+            lines.append(f"✅ {line}" if error is None else f"❌ {line} — {error}")
+        await message.answer("\n".join(lines))
 
     # Очищаем состояние
     await state.clear()
@@ -253,8 +317,9 @@ async def handle_code_from_barista(message: Message, session: AsyncSession, stat
 
 # --- Выдать баллы (только для администратора) ---
 @barista_router.message(F.text == "Выдать баллы")
+@flags.read_only
 async def ask_for_add_points(message: Message, state: FSMContext, session: AsyncSession):
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if not is_admin:
         await message.answer("У вас нет прав для выполнения этой команды.")
@@ -265,9 +330,10 @@ async def ask_for_add_points(message: Message, state: FSMContext, session: Async
 
 
 @barista_router.message(BaristaStates.waiting_for_add_points, F.text.contains(" "))
+@flags.read_only
 async def handle_ask_for_add_points(message: Message, session: AsyncSession, state: FSMContext):
     # Проверяем, что пользователь всё ещё администратор (защита от подмены)
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if not is_admin:
         await message.answer("У вас нет прав для выполнения этой команды.")
@@ -307,9 +373,12 @@ async def handle_ask_for_add_points(message: Message, session: AsyncSession, sta
 @barista_router.message(BaristaStates.waiting_for_add_points, F.text.isdigit())
 async def handle_add_points(message: Message, session: AsyncSession, state: FSMContext):
     # ПОВТОРНАЯ ПРОВЕРКА АДМИНА — КРИТИЧЕСКИ ВАЖНО!
-    is_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_admin = await is_admin_barista(message.from_user.id, session)
 
     if not is_admin:
+        # Перед ответом без записи завершаем транзакцию, чтобы не держать
+        # соединение (в SQLite — единственное пишущее) во время запроса к Telegram
+        await session.rollback()
         await message.answer("У вас нет прав для выполнения этой команды.")
         await state.clear()
         return
@@ -317,6 +386,7 @@ async def handle_add_points(message: Message, session: AsyncSession, state: FSMC
     points_to_add = int(message.text.strip())
 
     if points_to_add <= 0:
+        await session.rollback()
         await message.answer("Количество баллов должно быть положительным числом.")
         return
 
@@ -324,14 +394,15 @@ async def handle_add_points(message: Message, session: AsyncSession, state: FSMC
     user_telegram_id = data.get('user_id')
 
     if not user_telegram_id:
+        await session.rollback()
         await message.answer("Ошибка: пользователь не найден. Попробуйте снова.")
         await state.clear()
         return
 
-    user = await session.execute(select(User).where(User.telegram_id == user_telegram_id))
-    user = user.scalar_one_or_none()
+    user = await get_customer(session, user_telegram_id)
 
     if not user:
+        await session.rollback()
         await message.answer("Пользователь не найден. Попробуйте снова.")
         await state.clear()
         return
@@ -339,24 +410,25 @@ async def handle_add_points(message: Message, session: AsyncSession, state: FSMC
     # Обновляем количество баллов пользователя
     stmt = (
         update(User)
-        .where(User.telegram_id == user_telegram_id)
+        .where(User.id == user.id)
         .values(points=User.points + points_to_add)
+        .returning(User.points)
+    )
+    points = (await session.execute(stmt)).scalar_one()
+    session.add(PointsHistory(user_id=user.id, delta=points_to_add, reason="add"))
+
+    # Уведомление пользователю уходит через outbox в той же транзакции
+    enqueue_notification(
+        session,
+        user.telegram_id,
+        f"Вам начислено {points_to_add} баллов! Теперь у вас {points} баллов."
     )
-    await session.execute(stmt)
     await session.commit()
-
-    # Отправляем уведомление пользователю
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    try:
-        await bot.send_message(
-            chat_id=user.telegram_id,
-            text=f"Вам начислено {points_to_add} баллов! Теперь у вас {user.points} баллов."
-        )
-    except Exception:
-        pass  # Не удалось отправить — не критично
+    wake_outbox()
+    customer_cache.set_points(user.telegram_id, points)
 
     await message.answer(
-        f"Пользователю {user.first_name} {user.phone[-4:]} начислено {points_to_add} баллов. Теперь у него {user.points} баллов.")
+        f"Пользователю {user.first_name} {user.phone_suffix} начислено {points_to_add} баллов. Теперь у него {points} баллов.")
     await state.clear()  # Важно: очищаем состояние после успешной операции
 
 
@@ -385,37 +457,49 @@ async def handle_deduct_points(message: Message, session: AsyncSession, state: F
     user = user.scalar_one_or_none()
 
     if not user:
+        # Перед ответом без записи завершаем транзакцию, чтобы не держать
+        # соединение (в SQLite — единственное пишущее) во время запроса к Telegram
+        await session.rollback()
         await message.answer("Пользователь не найден.")
         return
 
     if user.points < 6:
-        await message.answer(f"У {user.first_name} недостаточно баллов для списания (требуется 6).")
+        await session.rollback()
+        await message.answer(f"У {first_name} недостаточно баллов для списания (требуется 6).")
         return
 
-    # Списываем 6 баллов
+    # Списываем 6 баллов (повторная проверка в самом UPDATE — защита от гонки)
     stmt = (
         update(User)
-        .where(User.telegram_id == user.telegram_id)
+        .where(User.id == user.id, User.points >= 6)
         .values(points=User.points - 6)
+        .returning(User.points)
     )
-    await session.execute(stmt)
-    await session.commit()
+    points = (await session.execute(stmt)).scalar_one_or_none()
 
-    # Отправляем уведомление клиенту
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    try:
-        await bot.send_message(
-            chat_id=user.telegram_id,
-            text="Поздравляем! Вы можете получить бесплатный напиток. 6 баллов списано."
-        )
-    except Exception:
-        pass  # Не удалось отправить — не критично
+    if points is None:
+        await session.rollback()
+        await message.answer(f"У {first_name} недостаточно баллов для списания (требуется 6).")
+        return
 
-    await message.answer(f"У {user.first_name} списано 6 баллов. Осталось: {user.points}")
+    session.add(PointsHistory(user_id=user.id, delta=-6, reason="deduct"))
+
+    # Уведомление клиенту уходит через outbox в той же транзакции
+    enqueue_notification(
+        session,
+        user.telegram_id,
+        "Поздравляем! Вы можете получить бесплатный напиток. 6 баллов списано."
+    )
+    await session.commit()
+    wake_outbox()
+    customer_cache.set_points(user.telegram_id, points)
+
+    await message.answer(f"У {user.first_name} списано 6 баллов. Осталось: {points}")
 
 
 # --- Обработка ввода после "Проверить баллы" ---
 @barista_router.message(BaristaStates.waiting_for_check_discount, F.text.contains(" "))
+@flags.read_only
 async def handle_check_discount(message: Message, session: AsyncSession, state: FSMContext):
     await state.clear()
 
@@ -442,7 +526,118 @@ async def handle_check_discount(message: Message, session: AsyncSession, state:
         await message.answer("Пользователь не найден.")
         return
 
-    await message.answer(f"У {user.first_name}: {user.points} баллов.")
+    history_button = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="История", callback_data=f"bhist:{user.id}")]
+    ])
+    await message.answer(f"У {user.first_name}: {user.points} баллов.", reply_markup=history_button)
+
+
+# --- История клиента для бариста ---
+# callback_data: "bhist:<id клиента>" — первая страница, "bhist:<id клиента>:<курсор>" — следующие
+@barista_router.callback_query(F.data.startswith("bhist:"))
+@flags.read_only
+async def show_client_history(callback_query: types.CallbackQuery, session: AsyncSession):
+    is_barista_user = await is_barista(callback_query.from_user.id, session)
+    if not is_barista_user:
+        await callback_query.answer("У вас нет доступа к этой функции.")
+        return
+
+    parts = callback_query.data.split(":", 2)
+    user_id = int(parts[1])
+    cursor = decode_history_cursor(parts[2]) if len(parts) == 3 else None
+
+    entries, next_cursor = await get_history_page(session, user_id, after=cursor)
+    text = format_history(entries)
+    reply_markup = history_keyboard(f"bhist:{user_id}", next_cursor)
+
+    if cursor is None:
+        await callback_query.message.answer(text, reply_markup=reply_markup)
+    else:
+        await callback_query.message.edit_text(text, reply_markup=reply_markup)
+    await callback_query.answer()
+
+
+# --- Статистика процесса (только для администратора) ---
+@barista_router.message(Command("stats"))
+@flags.read_only
+async def cmd_stats(
+    message: Message,
+    session: AsyncSession,
+    admission: Optional[AdmissionControlMiddleware] = None,
+    fsm_storage: Optional[BaseStorage] = None
+):
+    is_admin = await is_admin_barista(message.from_user.id, session)
+
+    if not is_admin:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    cache_stats = customer_cache.stats()
+    await message.answer(
+        "Кэш клиентов:\n"
+        f"записей: {cache_stats['size']}\n"
+        f"попаданий: {cache_stats['hits']}, промахов: {cache_stats['misses']}\n"
+        f"hit rate: {cache_stats['hit_rate']:.1%}"
+    )
+
+    if admission is not None:
+        admission_stats = admission.stats()
+        queued = admission_stats["queued"]
+        shed = admission_stats["shed"]
+        await message.answer(
+            "Нагрузка:\n"
+            f"в работе: {admission_stats['active']} из {admission_stats['max_concurrency']}\n"
+            f"в очереди: бариста {queued['staff']}, коды {queued['redeem']}, прочее {queued['browse']}\n"
+            f"отброшено: бариста {shed['staff']}, коды {shed['redeem']}, прочее {shed['browse']}"
+        )
+
+    if isinstance(fsm_storage, BoundedMemoryStorage):
+        storage_stats = fsm_storage.stats()
+        await message.answer(
+            "Состояния FSM:\n"
+            f"записей: {storage_stats['entries']}\n"
+            f"память: ~{storage_stats['bytes'] / 1024:.1f} КБ\n"
+            f"истекло: {storage_stats['expired']}, вытеснено: {storage_stats['evicted']}"
+        )
+
+
+# --- Профилирование живого процесса (только для администратора) ---
+# Ссылки на фоновые задачи профилирования, чтобы их не собрал сборщик мусора
+_profile_tasks = set()
+
+
+async def _profile_and_send(message: Message, seconds: int):
+    try:
+        path, samples = await run_sampling_profile(seconds, PROFILE_DIR)
+        await message.answer_document(FSInputFile(path), caption=f"Сэмплов: {samples}. Файл: {path}")
+    except RuntimeError as e:
+        await message.answer(str(e))
+    except Exception as e:
+        print(f"Failed to take profile: {e}")
+
+
+@barista_router.message(Command("profile"))
+@flags.read_only
+async def cmd_profile(message: Message, session: AsyncSession, command: CommandObject):
+    is_admin = await is_admin_barista(message.from_user.id, session)
+    # Сессия больше не нужна — не держим транзакцию открытой, пока идёт профилирование
+    await session.close()
+
+    if not is_admin:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    # /profile [секунды], по умолчанию 10, не больше 60
+    seconds = int(command.args) if command.args and command.args.strip().isdigit() else 10
+    seconds = max(1, min(seconds, 60))
+
+    # Профиль снимается в отдельной задаче: апдейт завершается сразу
+    # и не занимает слот AdmissionControlMiddleware
+    task = asyncio.create_task(_profile_and_send(message, seconds))
+    _profile_tasks.add(task)
+    task.add_done_callback(_profile_tasks.discard)
+
+    await message.answer(f"Снимаю профиль {seconds} с, пришлю файл, когда закончу.")
 
 
 @barista_router.message(F.text == "Правила акции")
@@ -1,7 +1,6 @@
 from datetime import datetime
 
-from aiogram import Bot
-from aiogram import Router, F, types
+from aiogram import Router, F, types, flags
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -9,9 +8,18 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKe
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from suda_bot.config import TELEGRAM_BOT_TOKEN
-from suda_bot.models import User, DailyCode, Barista
-from suda_bot.utils import cleanup_old_codes_for_user, get_or_create_daily_code
+from suda_bot.cache import CachedCustomer, customer_cache
+from suda_bot.models import User, DailyCode, Barista, PointsHistory
+from suda_bot.outbox import enqueue_notification, wake_outbox
+from suda_bot.utils import (
+    cleanup_old_codes_for_user,
+    get_or_create_daily_code,
+    get_customer,
+    get_history_page,
+    format_history,
+    encode_history_cursor,
+    decode_history_cursor,
+)
 
 # Создаём роутер для обработки сообщений от пользователей (клиентов)
 user_router = Router()
@@ -43,21 +51,31 @@ def main_menu_keyboard():
     kb = [
         [KeyboardButton(text="Получить код")],
         [KeyboardButton(text="Мои баллы")],
+        [KeyboardButton(text="История")],
         [KeyboardButton(text="Правила акции")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
+# Inline-кнопка "Далее" под страницей истории; prefix — callback_data без курсора
+def history_keyboard(prefix: str, next_cursor):
+    if next_cursor is None:
+        return None
+    kb = [
+        [InlineKeyboardButton(text="Далее", callback_data=f"{prefix}:{encode_history_cursor(next_cursor)}")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
 # --- Вспомогательные функции для проверки бариста и админа ---
 
 # Проверяет, является ли пользователь администратором (is_admin = True)
-async def is_admin_barista(telegram_id: str, session: AsyncSession) -> bool:
+async def is_admin_barista(telegram_id: int, session: AsyncSession) -> bool:
     barista = await session.execute(
         select(Barista).where(Barista.telegram_id == telegram_id, Barista.is_admin == True)
     )
     return barista.scalar_one_or_none() is not None
 
 # Проверяет, является ли пользователь бариста (любой, не обязательно админ)
-async def is_barista(telegram_id: str, session: AsyncSession) -> bool:
+async def is_barista(telegram_id: int, session: AsyncSession) -> bool:
     barista = await session.execute(select(Barista).where(Barista.telegram_id == telegram_id))
     return barista.scalar_one_or_none() is not None
 
@@ -65,9 +83,10 @@ async def is_barista(telegram_id: str, session: AsyncSession) -> bool:
 
 # Обработчик команды /start
 @user_router.message(Command("start"))
+@flags.read_only
 async def cmd_start(message: Message, session: AsyncSession, state: FSMContext):
     # Проверяем, администратор ли это (приоритетнее)
-    is_user_admin = await is_admin_barista(str(message.from_user.id), session)
+    is_user_admin = await is_admin_barista(message.from_user.id, session)
 
     if is_user_admin:
         # Перенаправляем в бариста, там уже будет админ-меню
@@ -76,7 +95,7 @@ async def cmd_start(message: Message, session: AsyncSession, state: FSMContext):
         return
 
     # Проверяем, бариста ли это (но не админ)
-    is_user_barista = await is_barista(str(message.from_user.id), session)
+    is_user_barista = await is_barista(message.from_user.id, session)
 
     if is_user_barista:
         # Перенаправляем в бариста
@@ -85,8 +104,7 @@ async def cmd_start(message: Message, session: AsyncSession, state: FSMContext):
         return
 
     # Обычный пользователь
-    user = await session.execute(select(User).where(User.telegram_id == str(message.from_user.id)))
-    user = user.scalar_one_or_none()
+    user = await get_customer(session, message.from_user.id)
 
     if user:
         await message.answer("Добро пожаловать в кофейню «Сюда»! ☕️", reply_markup=main_menu_keyboard())
@@ -149,12 +167,14 @@ async def process_phone_from_contact(message: Message, session: AsyncSession, st
     first_name = data['first_name']
 
     new_user = User(
-        telegram_id=str(message.from_user.id),
+        telegram_id=message.from_user.id,
         first_name=first_name,
-        phone=phone
+        phone=phone,
+        points=0
     )
     session.add(new_user)
     await session.commit()
+    customer_cache.put(CachedCustomer.from_user(new_user))
 
     await state.clear()
 
@@ -172,15 +192,18 @@ async def process_phone_invalid(message: Message):
 # --- Обработка кнопки "Получить код" ---
 @user_router.message(F.text == "Получить код")
 async def request_code(message: Message, session: AsyncSession):
-    user = await session.execute(select(User).where(User.telegram_id == str(message.from_user.id)))
-    user = user.scalar_one_or_none()
+    user = await get_customer(session, message.from_user.id)
 
+    # Перед ответом без записи завершаем транзакцию, чтобы не держать
+    # соединение (в SQLite — единственное пишущее) во время запроса к Telegram
     if not user:
+        await session.rollback()
         await message.answer("Сначала зарегистрируйтесь используя /start")
         return
 
-    is_user_barista = await is_barista(str(message.from_user.id), session)
+    is_user_barista = await is_barista(message.from_user.id, session)
     if is_user_barista:
+        await session.rollback()
         await message.answer("Вы бариста — используйте кнопки", reply_markup=ReplyKeyboardMarkup(keyboard=[], resize_keyboard=True))
         return
 
@@ -190,28 +213,22 @@ async def request_code(message: Message, session: AsyncSession):
     # Получаем или создаём код на сегодня
     code_entry = await get_or_create_daily_code(session, user.id)
 
-    # Отправляем код бариста (всем бариста)
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    # Отправляем код бариста (всем бариста) через outbox
     baristas = await session.execute(select(Barista.telegram_id))
     barista_ids = [b[0] for b in baristas.fetchall()]
 
     for barista_id in barista_ids:
-        try:
-            await bot.send_message(
-                chat_id=barista_id,
-                text=f"{user.first_name} {user.phone[-4:]}: {code_entry.code}"
-            )
-        except Exception as e:
-            print(f"Failed to send message to barista {barista_id}: {e}")
-            pass
+        enqueue_notification(session, barista_id, f"{user.first_name} {user.phone_suffix}: {code_entry.code}")
+    await session.commit()
+    wake_outbox()
 
     await message.answer("Ваш запрос на код отправлен бариста. Скажите ему свое имя.")
 
 # --- Обработка кнопки "Мои баллы" ---
 @user_router.message(F.text == "Мои баллы")
+@flags.read_only
 async def show_discount(message: Message, session: AsyncSession):
-    user = await session.execute(select(User).where(User.telegram_id == str(message.from_user.id)))
-    user = user.scalar_one_or_none()
+    user = await get_customer(session, message.from_user.id)
 
     if not user:
         await message.answer("Сначала зарегистрируйтесь используя /start")
@@ -219,6 +236,34 @@ async def show_discount(message: Message, session: AsyncSession):
 
     await message.answer(f"У вас баллов:{user.points}")
 
+# --- Обработка кнопки "История" ---
+@user_router.message(F.text == "История")
+@flags.read_only
+async def show_history(message: Message, session: AsyncSession):
+    user = await get_customer(session, message.from_user.id)
+
+    if not user:
+        await message.answer("Сначала зарегистрируйтесь используя /start")
+        return
+
+    entries, next_cursor = await get_history_page(session, user.id)
+    await message.answer(format_history(entries), reply_markup=history_keyboard("hist", next_cursor))
+
+# Следующая страница истории: callback_data "hist:<курсор>"
+@user_router.callback_query(F.data.startswith("hist:"))
+@flags.read_only
+async def show_history_page(callback_query: types.CallbackQuery, session: AsyncSession):
+    user = await get_customer(session, callback_query.from_user.id)
+
+    if not user:
+        await callback_query.answer("Сначала зарегистрируйтесь используя /start")
+        return
+
+    cursor = decode_history_cursor(callback_query.data.split(":", 1)[1])
+    entries, next_cursor = await get_history_page(session, user.id, after=cursor)
+    await callback_query.message.edit_text(format_history(entries), reply_markup=history_keyboard("hist", next_cursor))
+    await callback_query.answer()
+
 # --- Обработка кнопки "Правила акции" ---
 @user_router.message(F.text == "Правила акции")
 async def show_rules(message: Message):
@@ -240,15 +285,18 @@ async def handle_code_from_client(message: Message, session: AsyncSession, state
 
     code = message.text.strip()
 
-    user = await session.execute(select(User).where(User.telegram_id == str(message.from_user.id)))
-    user = user.scalar_one_or_none()
+    user = await get_customer(session, message.from_user.id)
 
+    # Перед ответом без записи завершаем транзакцию, чтобы не держать
+    # соединение (в SQLite — единственное пишущее) во время запроса к Telegram
     if not user:
+        await session.rollback()
         await message.answer("Пожалуйста, сначала зарегистрируйтесь используя /start")
         return
 
-    is_user_barista = await is_barista(str(message.from_user.id), session)
+    is_user_barista = await is_barista(message.from_user.id, session)
     if is_user_barista:
+        await session.rollback()
         await message.answer("Вы бариста — используйте кнопки", reply_markup=ReplyKeyboardMarkup(keyboard=[], resize_keyboard=True))
         return
 
@@ -261,10 +309,12 @@ async def handle_code_from_client(message: Message, session: AsyncSession, state
     db_code = db_code.scalar_one_or_none()
 
     if not db_code:
+        await session.rollback()
         await message.answer("Неверный или уже использованный код")
         return
 
     if db_code.user_id != user.id:
+        await session.rollback()
         await message.answer("Этот код не принадлежит вам")
         return
 
@@ -279,16 +329,16 @@ async def handle_code_from_client(message: Message, session: AsyncSession, state
     # Обновляем пользователя: +1 балл
     stmt_user = (
         update(User)
-        .where(User.telegram_id == str(message.from_user.id))
+        .where(User.id == user.id)
         .values(
             points=User.points + 1,
             last_check_in=datetime.now()
         )
+        .returning(User.points)
     )
-    await session.execute(stmt_user)
+    points = (await session.execute(stmt_user)).scalar_one()
+    session.add(PointsHistory(user_id=user.id, delta=1, reason="code"))
     await session.commit()
+    customer_cache.set_points(user.telegram_id, points)
 
-    updated_user = await session.execute(select(User).where(User.telegram_id == str(message.from_user.id)))
-    updated_user = updated_user.scalar_one()
-
-    await message.answer(f"Вы получили 1 балл! У вас теперь {updated_user.points} баллов.")
\ No newline at end of file
+    await message.answer(f"Вы получили 1 балл! У вас теперь {points} баллов.")
\ No newline at end of file
@@ -1,11 +1,58 @@
+import asyncio
+import re
+import time
+from collections import deque
+
 from aiogram import BaseMiddleware
-from typing import Callable, Dict, Any
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Update
+from typing import Callable, Dict, Any, Optional, Sequence
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+
+from suda_bot.cache import staff_cache
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed(session: Session):
+    session.info["committed"] = True
+
 
 class DatabaseSessionMiddleware(BaseMiddleware):
-    def __init__(self, session_pool: async_sessionmaker):
+    """Открывает сессию на каждый апдейт.
+
+    Обработчики с флагом ``read_only`` получают сессию реплики, остальные —
+    основной базы. Пользователь, который только что сам что-то записал,
+    ещё ``read_your_writes`` секунд читает из основной базы, чтобы не увидеть
+    отстающую реплику.
+    """
+
+    def __init__(
+        self,
+        session_pool: async_sessionmaker,
+        replica_pool: Optional[async_sessionmaker] = None,
+        read_your_writes: float = 5.0
+    ):
         super().__init__()
         self.session_pool = session_pool
+        self.replica_pool = replica_pool
+        self.read_your_writes = read_your_writes
+        self._last_write: Dict[int, float] = {}
+
+    def _wrote_recently(self, user_id: Optional[int]) -> bool:
+        last_write = self._last_write.get(user_id)
+        return last_write is not None and time.monotonic() - last_write < self.read_your_writes
+
+    def _mark_write(self, user_id: int):
+        now = time.monotonic()
+        self._last_write[user_id] = now
+        # Не даём словарю расти бесконечно
+        if len(self._last_write) > 1024:
+            self._last_write = {
+                uid: ts for uid, ts in self._last_write.items()
+                if now - ts < self.read_your_writes
+            }
 
     async def __call__(
         self,
@@ -13,6 +60,172 @@ class DatabaseSessionMiddleware(BaseMiddleware):
         event: object,
         data: Dict[str, Any]
     ) -> Any:
+        user = data.get("event_from_user")
+        user_id = user.id if user else None
+
+        if (
+            self.replica_pool is not None
+            and self.replica_pool is not self.session_pool
+            and get_flag(data, "read_only")
+            and not self._wrote_recently(user_id)
+        ):
+            async with self.replica_pool() as session:
+                data["session"] = session
+                return await handler(event, data)
+
         async with self.session_pool() as session:
             data["session"] = session
-            return await handler(event, data)
\ No newline at end of file
+            try:
+                return await handler(event, data)
+            finally:
+                if user_id is not None and session.info.get("committed"):
+                    self._mark_write(user_id)
+
+
+# Классы приоритета апдейтов: меньше — важнее
+PRIORITY_STAFF = 0
+PRIORITY_REDEEM = 1
+PRIORITY_BROWSE = 2
+PRIORITY_NAMES = ("staff", "redeem", "browse")
+
+_CODE_RE = re.compile(r"^\d{6}$")
+
+
+class AdmissionControlMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых апдейтов.
+
+    Апдейты сверх лимита ждут в очередях по классам: бариста и
+    администраторы, затем получение и ввод кода, затем всё остальное.
+    Освободившийся слот достаётся самому приоритетному ожидающему.
+
+    ``queue_sizes[c]`` — сколько апдейтов класса ``c`` и всех классов ниже
+    может ждать одновременно, так что очередь класса никогда не длиннее
+    своего лимита. Когда лимит достигнут, отбрасывается самый низкий класс:
+    новый апдейт вытесняет ожидающий апдейт более низкого класса или, если
+    вытеснять некого, получает ответ «попробуйте ещё раз».
+
+    Регистрируется как outer-middleware на dp.update.
+    """
+
+    def __init__(
+        self,
+        session_pool: async_sessionmaker,
+        max_concurrency: int = 8,
+        queue_sizes: Sequence[int] = (100, 50, 20)
+    ):
+        super().__init__()
+        self.session_pool = session_pool
+        self.max_concurrency = max_concurrency
+        self.queue_sizes = tuple(queue_sizes)
+        self._active = 0
+        self._queues = [deque() for _ in PRIORITY_NAMES]
+        self.admitted = [0] * len(PRIORITY_NAMES)
+        self.shed = [0] * len(PRIORITY_NAMES)
+
+    async def _classify(self, update: Update, data: Dict[str, Any]) -> int:
+        user = data.get("event_from_user")
+        if user is not None:
+            if staff_cache.is_stale:
+                try:
+                    await staff_cache.refresh(self.session_pool)
+                except Exception as e:
+                    # Классифицируем по прежнему списку, обновим на следующем апдейте
+                    print(f"Staff cache refresh failed: {e}")
+            if user.id in staff_cache:
+                return PRIORITY_STAFF
+
+        text = update.message.text if update.message else None
+        if text and (text == "Получить код" or _CODE_RE.match(text)):
+            return PRIORITY_REDEEM
+        return PRIORITY_BROWSE
+
+    def _has_room(self, priority: int) -> bool:
+        """Можно ли поставить в очередь апдейт класса priority, не превысив лимиты"""
+        waiting = 0
+        for level in range(len(self._queues) - 1, -1, -1):
+            waiting += len(self._queues[level])
+            if level <= priority and waiting >= self.queue_sizes[level]:
+                return False
+        return True
+
+    def _evict_lower(self, priority: int) -> bool:
+        """Вытесняет самый свежий ожидающий апдейт самого низкого класса ниже priority"""
+        for lower in range(len(self._queues) - 1, priority, -1):
+            queue = self._queues[lower]
+            while queue:
+                waiter = queue.pop()
+                if not waiter.done():
+                    waiter.set_result(False)
+                    self.shed[lower] += 1
+                    return True
+        return False
+
+    async def _acquire(self, priority: int) -> bool:
+        if self._active < self.max_concurrency and not any(self._queues):
+            self._active += 1
+            return True
+
+        # Вытеснение апдейта ниже priority уменьшает на единицу все лимиты,
+        # в которые входит новый апдейт, — после него место есть
+        if not self._has_room(priority) and not self._evict_lower(priority):
+            self.shed[priority] += 1
+            return False
+
+        queue = self._queues[priority]
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter in queue:
+                queue.remove(waiter)
+            elif waiter.done() and not waiter.cancelled() and waiter.result():
+                # Слот уже передан нам — возвращаем его
+                self._release()
+            raise
+
+    def _release(self):
+        # Передаём слот самому приоритетному ожидающему, не уменьшая счётчик
+        for queue in self._queues:
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    waiter.set_result(True)
+                    return
+        self._active -= 1
+
+    @staticmethod
+    async def _reply_busy(update: Update):
+        text = "Сейчас много запросов, попробуйте ещё раз через минуту."
+        if update.message:
+            await update.message.answer(text)
+        elif update.callback_query:
+            await update.callback_query.answer(text)
+
+    async def __call__(
+        self,
+        handler: Callable,
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        priority = await self._classify(event, data)
+
+        if not await self._acquire(priority):
+            await self._reply_busy(event)
+            return None
+
+        self.admitted[priority] += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queued": {name: len(q) for name, q in zip(PRIORITY_NAMES, self._queues)},
+            "admitted": dict(zip(PRIORITY_NAMES, self.admitted)),
+            "shed": dict(zip(PRIORITY_NAMES, self.shed))
+        }
@@ -1,14 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
-from suda_bot.database import Base
+from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, Index
 from suda_bot.database import Base
 
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(String, unique=True, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, nullable=False)
     first_name = Column(String, nullable=True)
     phone = Column(String, nullable=True)
     points = Column(Integer, default=0)
@@ -19,7 +18,7 @@ class DailyCode(Base):
 
     id = Column(Integer, primary_key=True)
     code = Column(String, unique=True, nullable=False)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     date = Column(DateTime, nullable=False)
     is_used = Column(Boolean, default=False)
 
@@ -27,5 +26,55 @@ class Barista(Base):
     __tablename__ = 'baristas'
 
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(String, unique=True, nullable=False)
-    is_admin = Column(Boolean, default=False)
\ No newline at end of file
+    telegram_id = Column(BigInteger, unique=True, nullable=False)
+    is_admin = Column(Boolean, default=False)
+
+class Notification(Base):
+    """Исходящее сообщение в Telegram (transactional outbox).
+
+    Пишется в той же транзакции, что и изменение баллов, и отправляется
+    фоновым воркером из suda_bot.outbox.
+    """
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='pending')  # pending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.now)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+class JobRun(Base):
+    """Журнал запусков задач планировщика"""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        Index('ix_job_runs_job_name_started_at', 'job_name', 'started_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='running')  # running / ok / error
+    started_at = Column(DateTime, nullable=False, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+    rows_affected = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+
+class PointsHistory(Base):
+    """Начисления и списания баллов клиента (история визитов)"""
+    __tablename__ = 'points_history'
+    __table_args__ = (
+        # Ключ keyset-пагинации: страница истории — один диапазон по индексу
+        Index('ix_points_history_user_id_redeemed_at', 'user_id', 'redeemed_at', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    delta = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)  # code / add / deduct
+    redeemed_at = Column(DateTime, nullable=False, default=datetime.now)
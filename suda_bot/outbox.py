@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from suda_bot.config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS
+from suda_bot.models import Notification
+
+_worker = None
+
+# Задержка между повторными попытками: 2, 4, 8 ... секунд, но не больше 10 минут
+BACKOFF_BASE = 2
+BACKOFF_MAX = 600
+# На сколько секунд воркер «забирает» пачку себе на время отправки
+CLAIM_TIMEOUT = 60
+
+
+def enqueue_notification(session: AsyncSession, chat_id: int, text: str):
+    """Ставит сообщение в outbox. Уйдёт после commit() текущей транзакции."""
+    session.add(Notification(chat_id=chat_id, text=text))
+
+
+class OutboxWorker:
+    """Фоновая отправка сообщений из таблицы outbox.
+
+    Забирает пачку готовых к отправке записей (FOR UPDATE SKIP LOCKED и
+    сдвиг next_attempt_at на CLAIM_TIMEOUT, чтобы несколько процессов не
+    отправляли одно и то же), отправляет их параллельно вне транзакции и
+    сохраняет статус. Неудачные попытки повторяются с экспоненциальной
+    задержкой. Доставка «как минимум один раз»: при падении между отправкой
+    и commit() сообщение уйдёт повторно.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_pool: async_sessionmaker,
+        batch_size: int = 50,
+        poll_interval: float = 5.0,
+        max_attempts: int = 8
+    ):
+        self.bot = bot
+        self.session_pool = session_pool
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Будит воркер сразу после commit(), не дожидаясь следующего опроса"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.drain_once()
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                processed = 0
+
+            # Пачка была полной — возможно, есть ещё
+            if processed >= self.batch_size:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain_once(self) -> int:
+        """Отправляет одну пачку сообщений. Возвращает количество обработанных записей."""
+        async with self.session_pool() as session:
+            notifications = await session.execute(
+                select(Notification)
+                .where(
+                    Notification.status == 'pending',
+                    Notification.next_attempt_at <= datetime.now()
+                )
+                .order_by(Notification.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            notifications = notifications.scalars().all()
+
+            if not notifications:
+                return 0
+
+            # Забираем пачку и отпускаем соединение на время сетевых запросов
+            claim_until = datetime.now() + timedelta(seconds=CLAIM_TIMEOUT)
+            for notification in notifications:
+                notification.next_attempt_at = claim_until
+            await session.commit()
+
+            results = await asyncio.gather(*(self._send(n) for n in notifications))
+
+            now = datetime.now()
+            for notification, (error, retry_after) in zip(notifications, results):
+                notification.attempts += 1
+                if error is None:
+                    notification.status = 'sent'
+                    notification.sent_at = now
+                    notification.last_error = None
+                    continue
+
+                notification.last_error = error
+                if retry_after is None or notification.attempts >= self.max_attempts:
+                    notification.status = 'failed'
+                else:
+                    notification.next_attempt_at = now + timedelta(seconds=retry_after)
+
+            await session.commit()
+            return len(notifications)
+
+    async def _send(self, notification: Notification):
+        """Возвращает (ошибка, через сколько секунд повторить); (None, None) — успех"""
+        try:
+            await self.bot.send_message(chat_id=notification.chat_id, text=notification.text)
+            return None, None
+        except TelegramRetryAfter as e:
+            return str(e), e.retry_after
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат не существует — повторять бессмысленно
+            return str(e), None
+        except Exception as e:
+            return str(e), min(BACKOFF_BASE ** (notification.attempts + 1), BACKOFF_MAX)
+
+
+def start_outbox_worker(bot: Bot, session_pool: async_sessionmaker) -> OutboxWorker:
+    global _worker
+    if _worker is None:
+        _worker = OutboxWorker(
+            bot,
+            session_pool,
+            batch_size=OUTBOX_BATCH_SIZE,
+            poll_interval=OUTBOX_POLL_INTERVAL,
+            max_attempts=OUTBOX_MAX_ATTEMPTS
+        )
+        _worker.start()
+    return _worker
+
+
+def wake_outbox():
+    if _worker is not None:
+        _worker.wake()
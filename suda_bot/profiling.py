@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import Update
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger("suda_bot.slow_updates")
+
+# Трейс апдейта, который обрабатывается в текущей задаче
+_current_trace: ContextVar[Optional["UpdateTrace"]] = ContextVar("suda_update_trace", default=None)
+
+
+class UpdateTrace:
+    """Замеры одного апдейта: общее время и спаны (handler, db, telegram)"""
+
+    def __init__(self, update: Update):
+        self.update = update
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, str, float]] = []
+
+    def add(self, kind: str, name: str, seconds: float):
+        self.spans.append((kind, name, seconds * 1000))
+
+    def report(self, total_ms: float) -> Dict[str, Any]:
+        by_kind = Counter()
+        for kind, _, ms in self.spans:
+            by_kind[kind] += ms
+        handler_ms = by_kind.get("handler", 0.0)
+        user = None
+        if self.update.message and self.update.message.from_user:
+            user = self.update.message.from_user.id
+        elif self.update.callback_query:
+            user = self.update.callback_query.from_user.id
+        return {
+            "event": "slow_update",
+            "update_id": self.update.update_id,
+            "update_type": self.update.event_type,
+            "user_id": user,
+            "total_ms": round(total_ms, 1),
+            "breakdown_ms": {
+                "middleware": round(total_ms - handler_ms, 1),
+                "handler": round(handler_ms, 1),
+                "db": round(by_kind.get("db", 0.0), 1),
+                "telegram": round(by_kind.get("telegram", 0.0), 1),
+                "python": round(handler_ms - by_kind.get("db", 0.0) - by_kind.get("telegram", 0.0), 1)
+            },
+            "spans": [
+                {"kind": kind, "name": name, "ms": round(ms, 1)}
+                for kind, name, ms in self.spans
+            ]
+        }
+
+
+class SlowUpdateMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: логирует в JSON апдейты медленнее порога"""
+
+    def __init__(self, threshold_ms: float):
+        super().__init__()
+        self.threshold_ms = threshold_ms
+
+    async def __call__(self, handler: Callable, event: Update, data: Dict[str, Any]) -> Any:
+        trace = UpdateTrace(event)
+        token = _current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_trace.reset(token)
+            total_ms = (time.perf_counter() - trace.started) * 1000
+            if total_ms >= self.threshold_ms:
+                logger.warning(json.dumps(trace.report(total_ms), ensure_ascii=False))
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренняя middleware: время самого обработчика"""
+
+    async def __call__(self, handler: Callable, event: object, data: Dict[str, Any]) -> Any:
+        trace = _current_trace.get()
+        if trace is None:
+            return await handler(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            callback = data.get("handler")
+            name = callback.callback.__name__ if callback is not None else "handler"
+            trace.add("handler", name, time.perf_counter() - started)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Время запросов к Telegram Bot API, сделанных при обработке апдейта"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        trace = _current_trace.get()
+        if trace is None:
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            trace.add("telegram", type(method).__name__, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("suda_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["suda_query_start"].pop()
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add("db", " ".join(statement.split())[:200], time.perf_counter() - started)
+
+
+def setup_slow_update_detector(dp: Dispatcher, bot: Bot, engines: List[AsyncEngine], threshold_ms: float):
+    """Включает замеры. Вызывать до регистрации остальных middleware.
+
+    Без вызова бот работает без единого лишнего перехватчика.
+    """
+    dp.update.outer_middleware(SlowUpdateMiddleware(threshold_ms))
+    bot.session.middleware(TelegramTimingMiddleware())
+    for engine in {id(e): e for e in engines}.values():
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def setup_handler_timing(dp: Dispatcher):
+    """Замер обработчиков — регистрируется последней, чтобы быть ближе всех к обработчику"""
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+
+
+# --- Сэмплирующий профайлер ---
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample_stacks(thread_id: int, duration: float, interval: float) -> Counter:
+    stacks = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def run_sampling_profile(duration: float, output_dir: str, interval: float = 0.005) -> Tuple[str, int]:
+    """Профилирует поток цикла событий duration секунд и пишет стеки в файл.
+
+    Формат — «свёрнутые стеки» (stack;stack;stack count), его понимают
+    flamegraph.pl и speedscope. Пока профиль не снимается, накладных
+    расходов нет. Возвращает путь к файлу и число сэмплов.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Профиль уже снимается")
+    try:
+        loop_thread_id = threading.get_ident()
+        stacks = await asyncio.to_thread(_sample_stacks, loop_thread_id, duration, interval)
+    finally:
+        _profile_lock.release()
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path, sum(stacks.values())
@@ -1,29 +1,138 @@
+import asyncio
+import zlib
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from sqlalchemy.ext.asyncio import async_sessionmaker
-from suda_bot.models import DailyCode
-from sqlalchemy import delete
+from suda_bot.config import CLEANUP_BATCH_SIZE
+from suda_bot.models import DailyCode, Notification, JobRun
+from sqlalchemy import delete, func, select, text
 from datetime import datetime, timedelta
 
 _scheduler = None
 
-async def cleanup_job(session_pool: async_sessionmaker):
+
+def _last_midnight() -> datetime:
+    return datetime.combine(datetime.now().date(), datetime.min.time())
+
+
+@asynccontextmanager
+async def job_lock(session_pool: async_sessionmaker, job_name: str):
+    """Advisory-блокировка PostgreSQL на время задачи: из всех реплик задачу выполняет одна.
+
+    Блокировка транзакционная и снимается сама при закрытии сессии (и при
+    обрыве соединения). В SQLite бот работает одним процессом — блокировка не нужна.
+    """
+    if session_pool.kw["bind"].dialect.name != "postgresql":
+        yield True
+        return
+
     async with session_pool() as session:
-        old_date = datetime.now() - timedelta(days=1)
-        await session.execute(
-            delete(DailyCode).where(
-                DailyCode.date < old_date
-            )
+        locked = await session.scalar(
+            text("SELECT pg_try_advisory_xact_lock(:key)"),
+            {"key": zlib.crc32(job_name.encode())}
         )
-        await session.commit()
+        yield locked
+
+
+async def run_exclusive(
+    session_pool: async_sessionmaker,
+    job_name: str,
+    job: Callable[[async_sessionmaker], Awaitable[int]],
+    due_since: Callable[[], datetime]
+):
+    """Запускает задачу не больше одного раза на период и записывает запуск в job_runs.
+
+    due_since() — начало текущего периода: если успешный запуск после этого
+    момента уже есть (его сделала другая реплика), задача пропускается.
+    """
+    async with job_lock(session_pool, job_name) as locked:
+        if not locked:
+            print(f"⏭ {job_name}: выполняется в другом процессе")
+            return
+
+        async with session_pool() as session:
+            last_run = await session.scalar(
+                select(func.max(JobRun.started_at)).where(
+                    JobRun.job_name == job_name,
+                    JobRun.status == 'ok'
+                )
+            )
+            if last_run is not None and last_run >= due_since():
+                return
+
+            run = JobRun(job_name=job_name, status='running', started_at=datetime.now())
+            session.add(run)
+            await session.commit()
+
+            try:
+                run.rows_affected = await job(session_pool)
+                run.status = 'ok'
+            except Exception as e:
+                run.status = 'error'
+                run.error = str(e)
+                print(f"❌ {job_name}: {e}")
+            run.finished_at = datetime.now()
+            await session.commit()
+
+
+async def delete_in_batches(session_pool: async_sessionmaker, model, *criteria) -> int:
+    """Удаляет строки пачками по CLEANUP_BATCH_SIZE, каждая пачка — отдельная транзакция"""
+    total = 0
+    while True:
+        async with session_pool() as session:
+            batch_ids = select(model.id).where(*criteria).limit(CLEANUP_BATCH_SIZE).scalar_subquery()
+            result = await session.execute(
+                delete(model)
+                .where(model.id.in_(batch_ids))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+        total += result.rowcount
+        if result.rowcount < CLEANUP_BATCH_SIZE:
+            return total
+        # Отдаём управление циклу событий между пачками
+        await asyncio.sleep(0)
+
+
+async def cleanup_job(session_pool: async_sessionmaker) -> int:
+    old_date = datetime.now() - timedelta(days=1)
+    deleted = await delete_in_batches(session_pool, DailyCode, DailyCode.date < old_date)
+    # Отправленные уведомления храним неделю
+    deleted += await delete_in_batches(
+        session_pool,
+        Notification,
+        Notification.status == 'sent',
+        Notification.sent_at < datetime.now() - timedelta(days=7)
+    )
+    # Неотправленные храним месяц — чтобы успеть разобраться, почему не ушли
+    deleted += await delete_in_batches(
+        session_pool,
+        Notification,
+        Notification.status == 'failed',
+        Notification.created_at < datetime.now() - timedelta(days=30)
+    )
     print("✅ Старые коды удалены")
+    return deleted
 
 def setup_scheduler(session_pool: async_sessionmaker):
     global _scheduler
     if _scheduler is None:
         _scheduler = AsyncIOScheduler()
-        _scheduler.add_job(cleanup_job, 'cron', hour=0, minute=0, args=[session_pool])
+        # next_run_time=now — догоняем пропущенный запуск после простоя
+        # (run_exclusive пропустит его, если за сегодня уже отработали)
+        _scheduler.add_job(
+            run_exclusive, 'cron', hour=0, minute=0,
+            args=[session_pool, "cleanup", cleanup_job, _last_midnight],
+            id="cleanup",
+            coalesce=True,
+            misfire_grace_time=None,
+            next_run_time=datetime.now()
+        )
         _scheduler.start()
     return _scheduler
 
 def get_scheduler():
-    return _scheduler
\ No newline at end of file
+    return _scheduler
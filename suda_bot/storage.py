@@ -0,0 +1,124 @@
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+    size: int = 0
+
+
+def _estimate_size(record: _Record) -> int:
+    """Приблизительный размер записи в байтах (без рекурсии во вложенные объекты)"""
+    size = sys.getsizeof(record) + sys.getsizeof(record.state) + sys.getsizeof(record.data)
+    for key, value in record.data.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """Замена MemoryStorage с ограниченным потреблением памяти.
+
+    Каждая запись живёт ``ttl`` секунд с последнего обращения, всего записей
+    не больше ``max_entries`` — лишние вытесняются по LRU. Записи упорядочены
+    по последнему обращению, поэтому они же упорядочены по сроку жизни:
+    очистка раз в ``sweep_interval`` секунд снимает просроченные с начала
+    и не просматривает остальные. Пустые записи (после state.clear())
+    удаляются сразу.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._records: "OrderedDict[StorageKey, _Record]" = OrderedDict()
+        self._bytes = 0
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.expired = 0
+        self.evicted = 0
+
+    def _drop(self, key: StorageKey):
+        record = self._records.pop(key)
+        self._bytes -= record.size
+
+    def _sweep(self, now: float):
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires_at > now:
+                break
+            self._drop(key)
+            self.expired += 1
+        self._next_sweep = now + self.sweep_interval
+
+    def _get(self, key: StorageKey) -> Optional[_Record]:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        record = self._records.get(key)
+        if record is None:
+            return None
+        if record.expires_at <= now:
+            self._drop(key)
+            self.expired += 1
+            return None
+
+        record.expires_at = now + self.ttl
+        self._records.move_to_end(key)
+        return record
+
+    def _save(self, key: StorageKey, record: _Record):
+        if record.state is None and not record.data:
+            if key in self._records:
+                self._drop(key)
+            return
+
+        if key not in self._records:
+            self._records[key] = record
+            record.expires_at = time.monotonic() + self.ttl
+            while len(self._records) > self.max_entries:
+                oldest = next(iter(self._records))
+                self._drop(oldest)
+                self.evicted += 1
+
+        self._bytes -= record.size
+        record.size = _estimate_size(record)
+        self._bytes += record.size
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key) or _Record()
+        record.state = state.state if isinstance(state, State) else state
+        self._save(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = self._get(key) or _Record()
+        record.data = dict(data)
+        self._save(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return dict(record.data) if record else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._records),
+            "bytes": self._bytes,
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
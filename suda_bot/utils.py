@@ -1,10 +1,12 @@
 import secrets
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from suda_bot.models import DailyCode
+from suda_bot.cache import CachedCustomer, customer_cache
+from suda_bot.models import DailyCode, User, PointsHistory
 
 
 def generate_numeric_code() -> str:
@@ -12,9 +14,23 @@ def generate_numeric_code() -> str:
     return f"{secrets.randbelow(10 ** 6):06d}"
 
 
+async def get_customer(session: AsyncSession, telegram_id: int) -> Optional[CachedCustomer]:
+    """Возвращает клиента из кэша, а при промахе — из базы (и кладёт в кэш)"""
+    customer = customer_cache.get(telegram_id)
+    if customer is not None:
+        return customer
+
+    user = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    user = user.scalar_one_or_none()
+    if not user:
+        return None
+
+    return customer_cache.put(CachedCustomer.from_user(user))
+
+
 async def cleanup_old_codes_for_user(session: AsyncSession, user_id: int):
     """Удаляет старые (неиспользованные) коды для пользователя"""
-    today = datetime.now().date()
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
     await session.execute(
         delete(DailyCode).where(
             DailyCode.user_id == user_id,
@@ -23,16 +39,25 @@ async def cleanup_old_codes_for_user(session: AsyncSession, user_id: int):
     )
 
 async def get_or_create_daily_code(session: AsyncSession, user_id: int) -> DailyCode:
-    """Возвращает существующий или создает новый код на сегодня для пользователя"""
-    today = datetime.now().date()
+    """Возвращает неиспользованный код на сегодня или создает новый"""
+    # Границы дня — datetime, а не date: сравнение DateTime с датой
+    # в PostgreSQL и SQLite работает по-разному
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
 
+    # Использованный код повторно не выдаём — клиент получит новый.
+    # Кодов на сегодня может быть несколько (раньше новый создавался
+    # на каждое нажатие), поэтому берём самый свежий, а не scalar_one_or_none()
     code_entry = await session.execute(
-        select(DailyCode).where(
+        select(DailyCode)
+        .where(
             DailyCode.user_id == user_id,
-            DailyCode.date == today
+            DailyCode.is_used == False,
+            DailyCode.date >= today,
+            DailyCode.date < today + timedelta(days=1)
         )
+        .order_by(DailyCode.id.desc())
     )
-    code_entry = code_entry.scalar_one_or_none()
+    code_entry = code_entry.scalars().first()
 
     if not code_entry:
         code = generate_numeric_code()
@@ -46,4 +71,57 @@ async def get_or_create_daily_code(session: AsyncSession, user_id: int) -> Daily
         await session.commit()
         code_entry = new_code
 
-    return code_entry
\ No newline at end of file
+    return code_entry
+
+
+HISTORY_PAGE_SIZE = 10
+HISTORY_REASONS = {
+    "code": "код",
+    "add": "начисление",
+    "deduct": "бесплатный напиток"
+}
+
+# Курсор страницы истории: (redeemed_at, id) последней показанной записи
+HistoryCursor = Tuple[datetime, int]
+
+
+def encode_history_cursor(cursor: HistoryCursor) -> str:
+    redeemed_at, entry_id = cursor
+    return f"{redeemed_at:%Y%m%d%H%M%S%f}:{entry_id}"
+
+
+def decode_history_cursor(value: str) -> HistoryCursor:
+    redeemed_at, entry_id = value.split(":")
+    return datetime.strptime(redeemed_at, "%Y%m%d%H%M%S%f"), int(entry_id)
+
+
+async def get_history_page(
+    session: AsyncSession,
+    user_id: int,
+    after: Optional[HistoryCursor] = None,
+    limit: int = HISTORY_PAGE_SIZE
+) -> Tuple[List[PointsHistory], Optional[HistoryCursor]]:
+    """Страница истории баллов, от новых к старым (keyset-пагинация).
+
+    Возвращает записи и курсор следующей страницы (None, если это последняя).
+    """
+    stmt = select(PointsHistory).where(PointsHistory.user_id == user_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(PointsHistory.redeemed_at, PointsHistory.id) < tuple_(*after))
+    stmt = stmt.order_by(PointsHistory.redeemed_at.desc(), PointsHistory.id.desc()).limit(limit + 1)
+
+    entries = (await session.execute(stmt)).scalars().all()
+    if len(entries) <= limit:
+        return entries, None
+
+    entries = entries[:limit]
+    return entries, (entries[-1].redeemed_at, entries[-1].id)
+
+
+def format_history(entries: List[PointsHistory]) -> str:
+    if not entries:
+        return "История пока пуста."
+    return "\n".join(
+        f"{e.redeemed_at:%d.%m.%Y %H:%M}  {e.delta:+d} ({HISTORY_REASONS.get(e.reason, e.reason)})"
+        for e in entries
+    )
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# suda_bot.database создаёт движок при импорте — тестам нужен хоть какой-то URL
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+os.environ.setdefault(
+    "DATABASE_URL",
+    f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'suda_bot_test.db')}"
+)
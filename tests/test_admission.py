@@ -0,0 +1,219 @@
+import asyncio
+
+from suda_bot.middleware import (
+    AdmissionControlMiddleware,
+    PRIORITY_BROWSE,
+    PRIORITY_REDEEM,
+    PRIORITY_STAFF,
+)
+
+
+def make_admission(queue_sizes=(100, 50, 20)) -> AdmissionControlMiddleware:
+    return AdmissionControlMiddleware(session_pool=None, max_concurrency=1, queue_sizes=queue_sizes)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def wait_for_slot(admission, priority, order, name):
+    admitted = await admission._acquire(priority)
+    order.append((name, admitted))
+    return admitted
+
+
+def queued(admission):
+    return [len(queue) for queue in admission._queues]
+
+
+def assert_within_limits(admission):
+    waiting = 0
+    for level in range(len(admission._queues) - 1, -1, -1):
+        waiting += len(admission._queues[level])
+        assert waiting <= admission.queue_sizes[level]
+
+
+def test_free_slot_is_taken_immediately():
+    async def scenario():
+        admission = make_admission()
+        assert await admission._acquire(PRIORITY_BROWSE)
+        assert admission.stats()["active"] == 1
+        admission._release()
+        assert admission.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_released_slot_goes_to_highest_priority():
+    async def scenario():
+        admission = make_admission()
+        order = []
+        assert await admission._acquire(PRIORITY_BROWSE)
+
+        tasks = [
+            asyncio.create_task(wait_for_slot(admission, PRIORITY_BROWSE, order, "browse")),
+            asyncio.create_task(wait_for_slot(admission, PRIORITY_REDEEM, order, "redeem")),
+            asyncio.create_task(wait_for_slot(admission, PRIORITY_STAFF, order, "staff")),
+        ]
+        await settle()
+        assert queued(admission) == [1, 1, 1]
+
+        for _ in tasks:
+            admission._release()
+            await settle()
+            # Слот передаётся, а не освобождается
+            assert admission.stats()["active"] == 1
+
+        await asyncio.gather(*tasks)
+        assert order == [("staff", True), ("redeem", True), ("browse", True)]
+        admission._release()
+        assert admission.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_same_class_is_served_in_arrival_order():
+    async def scenario():
+        admission = make_admission()
+        order = []
+        assert await admission._acquire(PRIORITY_REDEEM)
+
+        tasks = [
+            asyncio.create_task(wait_for_slot(admission, PRIORITY_REDEEM, order, name))
+            for name in ("first", "second")
+        ]
+        await settle()
+        admission._release()
+        await settle()
+        admission._release()
+        await asyncio.gather(*tasks)
+        assert [name for name, _ in order] == ["first", "second"]
+
+    asyncio.run(scenario())
+
+
+def test_higher_class_evicts_newest_waiter_of_lowest_class():
+    async def scenario():
+        admission = make_admission(queue_sizes=(3, 2, 2))
+        order = []
+        assert await admission._acquire(PRIORITY_STAFF)
+
+        old_browse = asyncio.create_task(wait_for_slot(admission, PRIORITY_BROWSE, order, "old"))
+        await settle()
+        new_browse = asyncio.create_task(wait_for_slot(admission, PRIORITY_BROWSE, order, "new"))
+        await settle()
+        assert queued(admission) == [0, 0, 2]
+
+        # Лимит для кода и ниже — 2, он достигнут: вытесняется последний browse
+        redeem = asyncio.create_task(wait_for_slot(admission, PRIORITY_REDEEM, order, "redeem"))
+        await settle()
+        assert await new_browse is False
+        assert queued(admission) == [0, 1, 1]
+        assert admission.stats()["shed"] == {"staff": 0, "redeem": 0, "browse": 1}
+
+        admission._release()
+        await settle()
+        admission._release()
+        await settle()
+        assert await redeem is True
+        assert await old_browse is True
+        admission._release()
+
+    asyncio.run(scenario())
+
+
+def test_arrival_is_shed_when_nothing_lower_to_evict():
+    async def scenario():
+        admission = make_admission(queue_sizes=(3, 1, 1))
+        order = []
+        assert await admission._acquire(PRIORITY_STAFF)
+
+        waiting = asyncio.create_task(wait_for_slot(admission, PRIORITY_REDEEM, order, "waiting"))
+        await settle()
+
+        assert await admission._acquire(PRIORITY_REDEEM) is False
+        assert await admission._acquire(PRIORITY_BROWSE) is False
+        assert queued(admission) == [0, 1, 0]
+        assert admission.stats()["shed"] == {"staff": 0, "redeem": 1, "browse": 1}
+
+        admission._release()
+        assert await waiting is True
+        admission._release()
+
+    asyncio.run(scenario())
+
+
+def test_queue_limits_hold_under_mixed_load():
+    async def scenario():
+        admission = make_admission(queue_sizes=(4, 3, 2))
+        assert await admission._acquire(PRIORITY_STAFF)
+
+        pattern = [PRIORITY_BROWSE, PRIORITY_REDEEM, PRIORITY_STAFF, PRIORITY_BROWSE, PRIORITY_REDEEM]
+        tasks = []
+        for i in range(30):
+            priority = pattern[i % len(pattern)]
+            tasks.append(asyncio.create_task(admission._acquire(priority)))
+            await settle()
+            assert_within_limits(admission)
+            for level, size in enumerate(admission.queue_sizes):
+                assert len(admission._queues[level]) <= size
+
+        assert sum(queued(admission)) == 4
+        # Всё отброшенное учтено в счётчиках
+        assert sum(admission.stats()["shed"].values()) == 30 - 4
+
+        while any(admission._queues):
+            admission._release()
+            await settle()
+        admission._release()
+        results = await asyncio.gather(*tasks)
+        assert results.count(True) == 4
+        assert admission.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        admission = make_admission()
+        assert await admission._acquire(PRIORITY_STAFF)
+
+        waiter = asyncio.create_task(admission._acquire(PRIORITY_BROWSE))
+        await settle()
+        assert queued(admission) == [0, 0, 1]
+
+        waiter.cancel()
+        await settle()
+        assert waiter.cancelled()
+        assert queued(admission) == [0, 0, 0]
+
+        admission._release()
+        assert admission.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_after_handoff_passes_slot_on():
+    async def scenario():
+        admission = make_admission()
+        order = []
+        assert await admission._acquire(PRIORITY_STAFF)
+
+        cancelled = asyncio.create_task(admission._acquire(PRIORITY_STAFF))
+        await settle()
+        next_in_line = asyncio.create_task(wait_for_slot(admission, PRIORITY_BROWSE, order, "next"))
+        await settle()
+
+        # Слот уже передан, но задача отменена раньше, чем успела его взять
+        admission._release()
+        cancelled.cancel()
+        await settle()
+        assert cancelled.cancelled()
+        assert await next_in_line is True
+        assert admission.stats()["active"] == 1
+
+        admission._release()
+        assert admission.stats()["active"] == 0
+
+    asyncio.run(scenario())